@@ -1,106 +1,162 @@
 #!/usr/bin/env python3
+import re
+import selectors
 import socket
 import time
 import json
 import sys
+import msgpack
+import orjson
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import threading
+import queue
+from urllib.parse import urlsplit
 
 # Configuration - UPDATE THIS IP ADDRESS
 AZURE_SERVER_URL = "http://20.211.145.100:80/gps"
+AZURE_UDP_PORT = None  # Set (e.g. 4002) to send best-effort msgpack datagrams instead of HTTP POSTs
+MAX_DATAGRAM_SIZE = 1400  # Stay below typical MTU to avoid IP fragmentation
 UDP_PORT = 4001
+UDP_RCVBUF_SIZE = 1 << 20  # Kernel receive buffer, large enough to absorb NMEA bursts
 DEVICE_ID = "IR1835"
 SEND_INTERVAL = 10  # Send data every 10 seconds (adjust as needed)
 REQUEST_TIMEOUT = 10
+MAX_PENDING_POINTS = 1000  # Oldest fixes are dropped once this many are waiting
+POSITION_EPSILON = 1e-6  # Degrees (~0.1 m); smaller moves are treated as the same fix
+ALTITUDE_EPSILON = 0.5  # Metres
+
+# $GPGGA/$GNGGA: time, lat (DDMM.MMMM), N/S, lon (DDDMM.MMMM), E/W, fix quality, satellites, HDOP, altitude
+GGA_RE = re.compile(
+    rb'^\$G[PN]GGA,[^,]*,(\d{4,}(?:\.\d+)?),([NS]?),(\d{5,}(?:\.\d+)?),([EW]?),'
+    rb'(\d)?,(\d+)?,[^,]*,(-?\d+(?:\.\d+)?)?'
+)
+GGA_PREFIXES = frozenset({b'$GPGGA', b'$GNGGA'})
+INV60 = 1.0 / 60.0
+FIX_QUALITY = ('Invalid', 'GPS', 'DGPS', 'PPS', 'RTK', 'Float RTK', 'Estimated')
+
+def parse_gga(data):
+    """Parse a raw GGA packet into (lat, lon, altitude, satellites, fix_quality), or None"""
+    m = GGA_RE.match(data)
+    if m is None:
+        return None
+    
+    # Parse latitude (DDMM.MMMM) with a single float conversion
+    v = float(m.group(1))
+    d = int(v * 0.01)
+    lat = d + (v - d * 100.0) * INV60
+    if m.group(2) == b'S':
+        lat = -lat
+    
+    # Parse longitude (DDDMM.MMMM)
+    v = float(m.group(3))
+    d = int(v * 0.01)
+    lon = d + (v - d * 100.0) * INV60
+    if m.group(4) == b'W':
+        lon = -lon
+    
+    # Extract additional data
+    fix_quality = int(m.group(5)) if m.group(5) is not None else None
+    satellites = int(m.group(6)) if m.group(6) is not None else None
+    altitude = float(m.group(7)) if m.group(7) is not None else None
+    
+    return (lat, lon, altitude, satellites, fix_quality)
+
+try:
+    # Compiled drop-in replacement built from nmea_parse.pyx (see Dockerfile)
+    from nmea_parse import parse_gga
+except ImportError:
+    pass
 
 class GPSSender:
     def __init__(self):
-        self.latest_gps_data = None
+        # Lock-free handoff of parsed fixes from the UDP listener to the sender
+        self.pending_gps_data = queue.SimpleQueue()
         self.running = True
-        self.data_lock = threading.Lock()
-        self.last_send_time = 0
+        self._stop = threading.Event()
+        self._unsent_batch = []  # Failed batch, owned by the periodic sender thread
+        self._last_sent_fix = None  # (lat, lon, altitude) of the last fix the server accepted over HTTP
+        self._has_sent_fix = False  # A fix has gone out over either transport, so heartbeats make sense
+        self._last_queued_fix = None  # (lat, lon, altitude) of the last fix queued, owned by the UDP listener
         
-    def parse_gps_from_nmea(self, line, sender_ip):
-        """Parse GPS data from NMEA sentence - same logic as gpsreader.py"""
+        # One persistent session so successive POSTs reuse the same keep-alive connection
+        self.session = requests.Session()
+        # Retry connecting once only: urllib3 never retries the (non-idempotent) batch POST on
+        # status or read errors, and a failed batch is folded into the next interval's send anyway,
+        # so more retries would just keep the single sender thread blocked during an outage
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=4,
+            max_retries=Retry(total=1, read=False, backoff_factor=0.5)
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json', 'Connection': 'keep-alive'})
+        
+        # Optional UDP transport to the same host; HTTP remains the fallback
+        self.udp_sock = None
+        if AZURE_UDP_PORT:
+            self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_sock.connect((urlsplit(AZURE_SERVER_URL).hostname, AZURE_UDP_PORT))
+        
+    def parse_gps_from_nmea(self, data, sender_ip):
+        """Parse GPS data from a raw NMEA GGA packet - same logic as gpsreader.py"""
         try:
-            if line.startswith('$GPGGA') or line.startswith('$GNGGA'):
-                parts = line.split(',')
-                if len(parts) > 6 and parts[2] and parts[4]:
-                    # Parse latitude
-                    lat = float(parts[2][:2]) + float(parts[2][2:]) / 60
-                    if parts[3] == 'S':
-                        lat = -lat
-                    
-                    # Parse longitude  
-                    lon = float(parts[4][:3]) + float(parts[4][3:]) / 60
-                    if parts[5] == 'W':
-                        lon = -lon
-                    
-                    # Extract additional data
-                    altitude = None
-                    satellites = None
-                    fix_quality = None
-                    
-                    if len(parts) > 9 and parts[9]:
-                        try:
-                            altitude = float(parts[9])
-                        except ValueError:
-                            pass
-                    
-                    if len(parts) > 7 and parts[7]:
-                        try:
-                            satellites = int(parts[7])
-                        except ValueError:
-                            pass
-                    
-                    if len(parts) > 6 and parts[6]:
-                        try:
-                            fix_quality_code = int(parts[6])
-                            fix_quality = {
-                                0: 'Invalid',
-                                1: 'GPS',
-                                2: 'DGPS',
-                                3: 'PPS',
-                                4: 'RTK',
-                                5: 'Float RTK',
-                                6: 'Estimated'
-                            }.get(fix_quality_code, f'Unknown({fix_quality_code})')
-                        except ValueError:
-                            pass
-                    
-                    gps_data = {
-                        "device_id": DEVICE_ID,
-                        "timestamp": datetime.now().isoformat(),
-                        "latitude": lat,
-                        "longitude": lon,
-                        "altitude": altitude,
-                        "satellites": satellites,
-                        "fix_quality": fix_quality,
-                        "source": "UDP_NMEA",
-                        "sender_ip": sender_ip,
-                        "raw_nmea": line
-                    }
-                    
-                    return gps_data
+            fields = parse_gga(data)
+            if fields is None:
+                return None
+            
+            # Keep the fix as a compact tuple; the JSON dict is only built when it is sent
+            return fields + (time.time(), data, sender_ip)
                     
         except (ValueError, IndexError) as e:
             print(f"Error parsing NMEA coordinates: {e}")
             
         return None
     
-    def send_to_azure_server(self, gps_data):
-        """Send GPS data to Azure Flask server"""
+    def build_gps_point(self, fix):
+        """Build the JSON-ready dict for a parsed GPS fix tuple"""
+        lat, lon, altitude, satellites, fix_quality, timestamp, raw_nmea, sender_ip = fix
+        
+        if fix_quality is not None:
+            if fix_quality < len(FIX_QUALITY):
+                fix_quality = FIX_QUALITY[fix_quality]
+            else:
+                fix_quality = f'Unknown({fix_quality})'
+        
+        return {
+            "device_id": DEVICE_ID,
+            "timestamp": timestamp,
+            "latitude": lat,
+            "longitude": lon,
+            "altitude": altitude,
+            "satellites": satellites,
+            "fix_quality": fix_quality,
+            "source": "UDP_NMEA",
+            "sender_ip": sender_ip,
+            "raw_nmea": raw_nmea.decode('ascii', errors='ignore').strip()
+        }
+    
+    def send_to_azure_server(self, batch):
+        """Send a batch of GPS fixes to Azure Flask server in a single POST"""
         try:
-            response = requests.post(
+            # Session already sends Content-Type: application/json
+            body = orjson.dumps({"device_id": DEVICE_ID, "points": [self.build_gps_point(fix) for fix in batch]})
+            response = self.session.post(
                 AZURE_SERVER_URL,
-                json=gps_data,
-                timeout=REQUEST_TIMEOUT,
-                headers={'Content-Type': 'application/json'}
+                data=body,
+                timeout=REQUEST_TIMEOUT
             )
             
-            if response.status_code == 200:
-                print(f"GPS data sent to Azure: {gps_data['latitude']:.6f}, {gps_data['longitude']:.6f}")
+            if 200 <= response.status_code < 300:
+                if batch:
+                    self._last_sent_fix = batch[-1][:3]
+                    self._has_sent_fix = True
+                    lat, lon = self._last_sent_fix[:2]
+                    print(f"Sent {len(batch)} GPS point(s) to Azure, latest: {lat:.6f}, {lon:.6f}")
+                else:
+                    print("Sent heartbeat to Azure (position unchanged)")
                 return True
             else:
                 print(f"Azure server error: HTTP {response.status_code}")
@@ -115,77 +171,186 @@ class GPSSender:
             
         return False
     
+    def send_udp(self, batch):
+        """Send a batch of GPS fixes to Azure as msgpack datagrams of at most MAX_DATAGRAM_SIZE bytes
+        
+        Returns how many fixes went out before any error, or -1 if no datagram was sent at all.
+        UDP gives no acknowledgement, so unlike the HTTP path this never updates _last_sent_fix;
+        it only marks that a fix has gone out so parked devices keep sending heartbeats.
+        """
+        packer = msgpack.Packer()
+        header = packer.pack_map_header(2) + packer.pack("device_id") + packer.pack(DEVICE_ID) + packer.pack("points")
+        budget = MAX_DATAGRAM_SIZE - len(header) - 3  # array header takes at most 3 bytes here
+        
+        # Pack each point once and split the batch into datagrams that fit the budget
+        datagrams = []
+        chunk = []
+        size = 0
+        for fix in batch:
+            packed = packer.pack(self.build_gps_point(fix))
+            if chunk and size + len(packed) > budget:
+                datagrams.append((len(chunk), header + packer.pack_array_header(len(chunk)) + b''.join(chunk)))
+                chunk = []
+                size = 0
+            chunk.append(packed)
+            size += len(packed)
+        datagrams.append((len(chunk), header + packer.pack_array_header(len(chunk)) + b''.join(chunk)))
+        
+        sent = -1
+        try:
+            for count, datagram in datagrams:
+                self.udp_sock.send(datagram)
+                sent = max(sent, 0) + count
+                if count:
+                    self._has_sent_fix = True
+        except OSError as e:
+            print(f"Error sending to Azure over UDP: {e}")
+            return sent
+        
+        if batch:
+            lat, lon = batch[-1][:2]
+            print(f"Sent {len(batch)} GPS point(s) to Azure over UDP in {len(datagrams)} datagram(s), latest: {lat:.6f}, {lon:.6f}")
+        else:
+            print("Sent heartbeat to Azure over UDP (position unchanged)")
+        return sent
+    
+    def send_batch(self, batch):
+        """Send a batch over UDP when configured, falling back to HTTP for whatever UDP didn't send
+        
+        Returns the fixes that still need sending; an empty list means the batch is done.
+        """
+        if self.udp_sock is not None:
+            sent = self.send_udp(batch)
+            if sent == len(batch):
+                return []
+            # Fixes already sent over UDP must not reach the server a second time
+            batch = batch[max(sent, 0):]
+        
+        if self.send_to_azure_server(batch):
+            return []
+        return batch
+    
+    def flush_pending_gps_data(self):
+        """Drain queued GPS fixes and send them as one batch, keeping it for retry on failure"""
+        batch = self._unsent_batch
+        self._unsent_batch = []
+        while True:
+            try:
+                batch.append(self.pending_gps_data.get_nowait())
+            except queue.Empty:
+                break
+        
+        if not batch:
+            if not self._has_sent_fix:
+                print("No GPS data available to send to Azure")
+                return False
+            # Device hasn't moved since the last sent fix; just let the server know it's alive
+            if self.udp_sock is not None and self.send_udp(batch) == 0:
+                return True
+            return self.send_to_azure_server(batch)
+        
+        # Keep the backlog bounded while the server is unreachable, dropping the oldest fixes
+        if len(batch) > MAX_PENDING_POINTS:
+            print(f"Dropping {len(batch) - MAX_PENDING_POINTS} queued GPS point(s)")
+            del batch[:-MAX_PENDING_POINTS]
+        
+        # Fold whatever failed into the next batch
+        self._unsent_batch = self.send_batch(batch)
+        return not self._unsent_batch
+    
+    def is_duplicate_fix(self, fix):
+        """Check whether a fix is within GPS noise of the last fix queued for Azure"""
+        # The last queued fix is never older than the last sent one, so it also covers
+        # "unchanged since last send"; comparing with _last_sent_fix would drop a return
+        # to a previous position while a different fix is still waiting to be sent
+        last = self._last_queued_fix
+        if last is None:
+            return False
+        
+        lat, lon, altitude = fix[:3]
+        last_lat, last_lon, last_altitude = last
+        if abs(lat - last_lat) >= POSITION_EPSILON or abs(lon - last_lon) >= POSITION_EPSILON:
+            return False
+        if altitude is None or last_altitude is None:
+            return altitude is last_altitude
+        return abs(altitude - last_altitude) < ALTITUDE_EPSILON
+    
+    def check_azure_server(self):
+        """Test Azure server connectivity, warming up the session's connection"""
+        print("Testing connection to Azure server...")
+        try:
+            response = self.session.get(AZURE_SERVER_URL.replace('/gps', '/health'), timeout=5)
+            if response.status_code == 200:
+                print("Azure server is reachable")
+            else:
+                print(f"Azure server responded with status {response.status_code}")
+        except Exception as e:
+            print(f"Cannot reach Azure server: {e}")
+            print("Continuing anyway - will retry when GPS data is available")
+    
     def udp_listener(self):
         """Listen for GPS data on UDP port"""
         try:
-            # Create UDP socket to receive NMEA data
+            # Create non-blocking UDP socket to receive NMEA data
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RCVBUF_SIZE)
             sock.bind(('0.0.0.0', UDP_PORT))
-            sock.settimeout(5.0)  # 5 second timeout
+            sock.setblocking(False)
+            
+            selector = selectors.DefaultSelector()
+            selector.register(sock, selectors.EVENT_READ)
             
             print(f"GPS UDP listener started - listening on port {UDP_PORT}")
             
             while self.running:
                 try:
-                    # Receive UDP packet
-                    data, addr = sock.recvfrom(1024)
-                    line = data.decode('ascii', errors='ignore').strip()
+                    if not selector.select(timeout=5.0):  # 5 second timeout
+                        print("No GPS data received in last 5 seconds...")
+                        continue
                     
-                    if line.startswith('$'):
-                        # print(f"NMEA (from {addr[0]}): {line}")
-                        
-                        # Parse GPS data from NMEA sentence
-                        gps_data = self.parse_gps_from_nmea(line, addr[0])
+                    # Drain every datagram already queued so a burst costs one wakeup
+                    packets = []
+                    while True:
+                        try:
+                            packets.append(sock.recvfrom(2048))
+                        except BlockingIOError:
+                            break
+                    
+                    # Parse GPS data straight from the raw NMEA packets
+                    batch = []
+                    for data, addr in packets:
+                        # print(f"NMEA (from {addr[0]}): {data}")
+                        # Cheap prefix check rejects RMC/GSV/etc. before running the regex
+                        if data[:6] not in GGA_PREFIXES:
+                            continue
+                        gps_data = self.parse_gps_from_nmea(data, addr[0])
+                        if gps_data and not self.is_duplicate_fix(gps_data):
+                            batch.append(gps_data)
+                            self._last_queued_fix = gps_data[:3]
+                    
+                    if batch:
+                        for gps_data in batch:
+                            self.pending_gps_data.put(gps_data)
                         
-                        if gps_data:
-                            with self.data_lock:
-                                self.latest_gps_data = gps_data
-                            
-                            print(f"GPS Position: Lat={gps_data['latitude']:.6f}, Lon={gps_data['longitude']:.6f}")
-                            
-                            # Send immediately if it's been long enough since last send
-                            current_time = time.time()
-                            if current_time - self.last_send_time >= SEND_INTERVAL:
-                                if self.send_to_azure_server(gps_data):
-                                    self.last_send_time = current_time
+                        print(f"GPS Position: Lat={gps_data[0]:.6f}, Lon={gps_data[1]:.6f}")
                         
-                except socket.timeout:
-                    print("No GPS data received in last 5 seconds...")
-                    continue
                 except Exception as e:
                     print(f"Error receiving GPS data: {e}")
                     if self.running:
-                        time.sleep(1)
+                        self._stop.wait(1)
                         
         except Exception as e:
             print(f"Failed to create UDP socket: {e}")
-            self.running = False
+            self.stop()
     
     def periodic_sender(self):
-        """Periodically send latest GPS data to Azure server"""
+        """Periodically send queued GPS data to Azure server - the only thread that sends"""
         print(f"Periodic sender started (interval: {SEND_INTERVAL} seconds)")
         
-        while self.running:
+        # Wait for the interval; returns early as soon as shutdown is requested
+        while not self._stop.wait(SEND_INTERVAL):
             try:
-                # Wait for the interval
-                for i in range(SEND_INTERVAL):
-                    if not self.running:
-                        break
-                    time.sleep(1)
-                
-                if not self.running:
-                    break
-                
-                # Send latest GPS data if available
-                with self.data_lock:
-                    if self.latest_gps_data:
-                        current_time = time.time()
-                        # Only send if we haven't sent recently
-                        if current_time - self.last_send_time >= SEND_INTERVAL:
-                            if self.send_to_azure_server(self.latest_gps_data):
-                                self.last_send_time = current_time
-                    else:
-                        print("No GPS data available to send to Azure")
+                self.flush_pending_gps_data()
                         
             except Exception as e:
                 print(f"Error in periodic sender: {e}")
@@ -198,6 +363,8 @@ class GPSSender:
         print(f"Device ID: {DEVICE_ID}")
         print(f"UDP Port: {UDP_PORT}")
         print(f"Azure Server: {AZURE_SERVER_URL}")
+        if AZURE_UDP_PORT:
+            print(f"Azure UDP Port: {AZURE_UDP_PORT}")
         print(f"Send Interval: {SEND_INTERVAL} seconds")
         print("="*60)
         
@@ -212,7 +379,12 @@ class GPSSender:
         except KeyboardInterrupt:
             print("\nShutting down GPS sender...")
         finally:
-            self.running = False
+            self.stop()
+    
+    def stop(self):
+        """Signal the listener and sender loops to shut down"""
+        self.running = False
+        self._stop.set()
 
 
 if __name__ == "__main__":
@@ -222,18 +394,9 @@ if __name__ == "__main__":
         print(f"Current URL: {AZURE_SERVER_URL}")
         sys.exit(1)
     
-    # Test Azure server connectivity
-    print("Testing connection to Azure server...")
-    try:
-        response = requests.get(AZURE_SERVER_URL.replace('/gps', '/health'), timeout=5)
-        if response.status_code == 200:
-            print("Azure server is reachable")
-        else:
-            print(f"Azure server responded with status {response.status_code}")
-    except Exception as e:
-        print(f"Cannot reach Azure server: {e}")
-        print("Continuing anyway - will retry when GPS data is available")
-    
-    # Create and run GPS sender
+    # Create GPS sender and test Azure server connectivity
     sender = GPSSender()
+    sender.check_azure_server()
+    
+    # Run GPS sender
     sender.run()
\ No newline at end of file
@@ -2,36 +2,113 @@
 
 from flask import Flask, request, jsonify
 from datetime import datetime
+import queue
+import socket
+import sys
+import threading
+import time
+import msgpack
+import orjson
+from waitress import serve
 
 app = Flask(__name__)
 
-@app.route('/gps', methods=['POST'])
-def receive_gps():
-    """Receive and display GPS data"""
+GPS_UDP_PORT = 4002  # msgpack datagrams from senders configured with AZURE_UDP_PORT
+
+# Raw request bodies (with their decoder) waiting to be decoded and printed off the request threads
+gps_queue = queue.Queue(maxsize=10000)
+RECEIVED_RESPONSE = (b'{"status":"received"}', 200, {'Content-Type': 'application/json'})
+
+def print_gps_data():
+    """Decode and display queued GPS data in the background"""
+    # Private block-buffered writer so prints coalesce; flushed whenever the queue runs dry
+    out = open(sys.stdout.fileno(), 'w', buffering=1 << 16, closefd=False)
+
+    while True:
+        remote_addr, received_at, body, loads = gps_queue.get()
+        try:
+            data = loads(body)
+            timestamp = datetime.fromtimestamp(received_at).strftime("%Y-%m-%d %H:%M:%S")
+
+            print(f"\n=== GPS Data Received at {timestamp} ===", file=out)
+            print(f"From IP: {remote_addr}", file=out)
+
+            # Senders may post a single fix or a batch of fixes under "points"
+            points = data.get("points")
+            if isinstance(points, list):
+                print(f"Device: {data.get('device_id')} ({len(points)} point(s))", file=out)
+            else:
+                points = [data]
+
+            for point in points:
+                print("-" * 50, file=out)
+                for key, value in point.items():
+                    print(f"{key}: {value}", file=out)
+
+            print("=" * 50, file=out)
+
+        except Exception as e:
+            print(f"Error: {e}", file=out)
+
+        if gps_queue.empty():
+            out.flush()
+
+def udp_receiver():
+    """Receive msgpack GPS datagrams and queue them for display"""
     try:
-        data = request.get_json()
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('0.0.0.0', GPS_UDP_PORT))
+    except OSError as e:
+        print(f"UDP listener not started on port {GPS_UDP_PORT}: {e}", flush=True)
+        return
+
+    while True:
+        try:
+            data, addr = sock.recvfrom(65535)
+            gps_queue.put_nowait((addr[0], time.time(), data, msgpack.unpackb))
+        except queue.Full:
+            # Best-effort transport; drop the datagram like the network would
+            pass
+        except Exception as e:
+            print(f"UDP error: {e}", flush=True)
 
-        print(f"\n=== GPS Data Received at {timestamp} ===")
-        print(f"From IP: {request.remote_addr}")
+background_threads_started = False
+background_threads_lock = threading.Lock()
 
-        for key, value in data.items():
-            print(f"{key}: {value}")
+def start_background_threads():
+    """Start the printer and UDP receiver threads, once per process"""
+    global background_threads_started
+    with background_threads_lock:
+        if background_threads_started:
+            return
+        background_threads_started = True
 
-        print("=" * 50)
+    threading.Thread(target=print_gps_data, daemon=True).start()
+    threading.Thread(target=udp_receiver, daemon=True).start()
 
-        return jsonify({"status": "received"}), 200
-    
-    except Exception as e:
-        print(f"Error: {e}")
-        return jsonify({"error": str(e)}), 500
+@app.before_request
+def ensure_background_threads():
+    # Covers WSGI servers that import gpsserver:app instead of running __main__
+    if not background_threads_started:
+        start_background_threads()
+
+@app.route('/gps', methods=['POST'])
+def receive_gps():
+    """Receive GPS data and queue it for display"""
+    try:
+        gps_queue.put_nowait((request.remote_addr, time.time(), request.get_data(), orjson.loads))
+        return RECEIVED_RESPONSE
+
+    except queue.Full:
+        return jsonify({"error": "server busy"}), 503
 
 @app.route('/health')
 def health():
     return jsonify({"status": "running"})
 
 if __name__ == '__main__':
-    print("GPS Server starting on port 80...")
-    print("Waiting for GPS data...\n")
-    app.run(host='0.0.0.0', port=80, debug=True)
-
+    print(f"GPS Server starting on port 80 (UDP {GPS_UDP_PORT})...")
+    start_background_threads()
+    print("Waiting for GPS data...\n", flush=True)
+    # Production WSGI server instead of the single-threaded Werkzeug dev server
+    serve(app, host='0.0.0.0', port=80, threads=8)
@@ -0,0 +1,155 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""Compiled $GPGGA/$GNGGA parser used by gpssender.py when it has been built.
+
+Accepts exactly what gpssender.GGA_RE accepts and returns the same values:
+(latitude, longitude, altitude, satellites, fix_quality), or None if the
+packet is not a usable GGA sentence.
+"""
+
+cdef double INV60 = 1.0 / 60.0
+cdef double POW10[23]
+POW10[0] = 1.0
+for _i in range(1, 23):
+    POW10[_i] = POW10[_i - 1] * 10.0
+
+
+cdef inline bint _is_digit(unsigned char c) nogil:
+    return c >= 48 and c <= 57
+
+
+cdef Py_ssize_t _scan_number(const unsigned char[::1] buf, Py_ssize_t pos, Py_ssize_t end,
+                             Py_ssize_t min_digits, bint allow_sign):
+    """Return the end of the longest `-?\\d{min_digits,}(\\.\\d+)?` match at pos, or -1"""
+    cdef Py_ssize_t i = pos
+    cdef Py_ssize_t start
+    if allow_sign and i < end and buf[i] == 45:  # '-'
+        i += 1
+    start = i
+    while i < end and _is_digit(buf[i]):
+        i += 1
+    if i - start < min_digits:
+        return -1
+    if i + 1 < end and buf[i] == 46 and _is_digit(buf[i + 1]):  # '.'
+        i += 2
+        while i < end and _is_digit(buf[i]):
+            i += 1
+    return i
+
+
+cdef double _to_double(const unsigned char[::1] buf, Py_ssize_t pos, Py_ssize_t end):
+    """Convert a scanned number to a double, rounding exactly like float()"""
+    cdef unsigned long long mantissa = 0
+    cdef int frac_digits = 0
+    cdef int digits = 0
+    cdef bint negative = False
+    cdef bint in_fraction = False
+    cdef Py_ssize_t i = pos
+    cdef double value
+    if buf[i] == 45:
+        negative = True
+        i += 1
+    while i < end:
+        if buf[i] == 46:
+            in_fraction = True
+        else:
+            if digits > 0 or buf[i] != 48:
+                digits += 1
+            mantissa = mantissa * 10 + (buf[i] - 48)
+            if in_fraction:
+                frac_digits += 1
+        i += 1
+    if digits > 15 or frac_digits > 22:
+        # Too long to convert exactly with one division; let Python do it
+        return float(bytes(buf[pos:end]))
+    # Both operands are exact, so the single division is correctly rounded
+    value = <double>mantissa / POW10[frac_digits]
+    return -value if negative else value
+
+
+cdef inline Py_ssize_t _find_comma(const unsigned char[::1] buf, Py_ssize_t pos, Py_ssize_t end):
+    while pos < end and buf[pos] != 44:  # ','
+        pos += 1
+    return pos if pos < end else -1
+
+
+cpdef tuple parse_gga(const unsigned char[::1] buf):
+    cdef Py_ssize_t end = buf.shape[0]
+    cdef Py_ssize_t pos, stop, d
+    cdef double v, lat, lon
+    cdef object altitude = None
+    cdef object satellites = None
+    cdef object fix_quality = None
+
+    # $G[PN]GGA,
+    if (end < 7 or buf[0] != 36 or buf[1] != 71 or (buf[2] != 80 and buf[2] != 78)
+            or buf[3] != 71 or buf[4] != 71 or buf[5] != 65 or buf[6] != 44):
+        return None
+
+    # UTC time
+    pos = _find_comma(buf, 7, end)
+    if pos < 0:
+        return None
+    pos += 1
+
+    # Latitude (DDMM.MMMM) and N/S
+    stop = _scan_number(buf, pos, end, 4, False)
+    if stop < 0 or stop >= end or buf[stop] != 44:
+        return None
+    v = _to_double(buf, pos, stop)
+    d = <Py_ssize_t>(v * 0.01)
+    lat = d + (v - d * 100.0) * INV60
+    pos = stop + 1
+    if pos < end and (buf[pos] == 78 or buf[pos] == 83):
+        if buf[pos] == 83:
+            lat = -lat
+        pos += 1
+    if pos >= end or buf[pos] != 44:
+        return None
+    pos += 1
+
+    # Longitude (DDDMM.MMMM) and E/W
+    stop = _scan_number(buf, pos, end, 5, False)
+    if stop < 0 or stop >= end or buf[stop] != 44:
+        return None
+    v = _to_double(buf, pos, stop)
+    d = <Py_ssize_t>(v * 0.01)
+    lon = d + (v - d * 100.0) * INV60
+    pos = stop + 1
+    if pos < end and (buf[pos] == 69 or buf[pos] == 87):
+        if buf[pos] == 87:
+            lon = -lon
+        pos += 1
+    if pos >= end or buf[pos] != 44:
+        return None
+    pos += 1
+
+    # Fix quality (single digit, optional)
+    if pos < end and _is_digit(buf[pos]):
+        fix_quality = buf[pos] - 48
+        pos += 1
+    if pos >= end or buf[pos] != 44:
+        return None
+    pos += 1
+
+    # Satellites (optional)
+    stop = pos
+    while stop < end and _is_digit(buf[stop]):
+        stop += 1
+    if stop >= end or buf[stop] != 44:
+        return None
+    if stop > pos:
+        satellites = int(bytes(buf[pos:stop]))
+    pos = stop + 1
+
+    # HDOP
+    pos = _find_comma(buf, pos, end)
+    if pos < 0:
+        return None
+    pos += 1
+
+    # Altitude (optional)
+    stop = _scan_number(buf, pos, end, 1, True)
+    if stop > 0:
+        altitude = _to_double(buf, pos, stop)
+
+    return (lat, lon, altitude, satellites, fix_quality)